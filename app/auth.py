@@ -1,67 +1,248 @@
+import asyncio
+import hashlib
 import httpx
-import os
-from jose import jwt, jwk
-from jose.exceptions import JWTError
-from fastapi import HTTPException, Depends
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from dotenv import load_dotenv
+import jwt
+import orjson
+import time
+from cachetools import TTLCache
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+from jwt.utils import base64url_decode
+from redis.exceptions import RedisError
+from fastapi import HTTPException, Request
+from app.config import settings
 
-load_dotenv()
+cached_verifiers = None
+# When cached_verifiers was last fetched (time.monotonic())
+verifiers_fetched_at = 0.0
+# When a JWKS fetch was last started, successful or not (time.monotonic())
+verifiers_attempted_at = 0.0
+# Only one request fetches the JWKS on a cold cache; the rest wait for it
+jwks_lock = asyncio.Lock()
+# How often the background task re-fetches the JWKS to pick up rotated keys
+JWKS_REFRESH_SECONDS = 600
+# Never trust a JWKS older than this, even if the background refresh keeps failing
+JWKS_MAX_AGE_SECONDS = 24 * 60 * 60
+# Unknown key IDs trigger a refresh at most this often, so bogus tokens can't hammer Auth0
+JWKS_MIN_REFRESH_SECONDS = 60
 
-AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
-AUTH0_AUDIENCE = os.getenv("AUTH0_AUDIENCE")
-JWKS_URL = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
-AUTH0_ISSUER = f'https://{AUTH0_DOMAIN}/'
+# Decoder and options are built once instead of on every jwt.decode call
+decoder = jwt.PyJWT()
+ALGORITHMS = ("RS256",)
+DECODE_OPTIONS = {"require": ["exp", "aud", "iss"], "verify_signature": True}
 
-cached_keys = None
+# Verified payloads keyed by token hash, so a replayed token skips RSA verification
+verified_tokens = TTLCache(maxsize=10_000, ttl=300)
 
-bearer = HTTPBearer()
+def build_public_key(key: dict):
+    # Build the RSA public key straight from the JWK modulus/exponent
+    n = int.from_bytes(base64url_decode(key['n']), 'big')
+    e = int.from_bytes(base64url_decode(key['e']), 'big')
+    return RSAPublicNumbers(e, n).public_key()
 
-async def get_public_keys():
-    global cached_keys
+def is_rsa_signing_key(key: dict):
+    # Only RS256 signing keys are usable here; skip anything else in the JWKS
+    # (EC keys, encryption keys...) instead of failing the whole load.
+    # "use" is optional in a JWK, so a key without it is still accepted
+    return (
+        key.get('kty') == 'RSA'
+        and key.get('use', 'sig') == 'sig'
+        and all(key.get(field) for field in ('kid', 'n', 'e'))
+    )
+
+def make_verifier(public_key):
+    # Everything except the token is fixed per key, so bind it into a closure
+    # once here and verification is a single call on the hot path
+    config = settings()
+    audience = config.audience
+    issuer = config.issuer
     
-    if cached_keys is not None:
-        return cached_keys
+    def verify(token_string: str):
+        return decoder.decode(
+            token_string,
+            key=public_key,
+            algorithms=ALGORITHMS,
+            options=DECODE_OPTIONS,
+            audience=audience,
+            issuer=issuer
+        )
+    return verify
+
+def read_key_id(token_string: str):
+    # Only decode the header segment - jwt.get_unverified_header also decodes
+    # the payload and signature, which jwt.decode does again anyway
+    header_segment = token_string.partition('.')[0]
+    try:
+        header = orjson.loads(base64url_decode(header_segment))
+    except ValueError:
+        return None
+    if not isinstance(header, dict):
+        return None
+    # kid is used as a dict key, so anything but a string is just an invalid token
+    key_id = header.get('kid')
+    return key_id if isinstance(key_id, str) else None
+
+async def fetch_verifiers(client: httpx.AsyncClient):
+    # Shared client keeps the connection to Auth0 alive between refreshes
+    response = await client.get(settings().jwks_url)
+    response.raise_for_status()
+    jwks_data = response.json()
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(JWKS_URL)
-        response.raise_for_status()
-        jwks_data = response.json()
+    # Construct each key once here; building it is the expensive part of
+    # verification and the JWKS only changes on rotation
+    return {
+        key['kid']: make_verifier(build_public_key(key))
+        for key in jwks_data['keys']
+        if is_rsa_signing_key(key)
+    }
+
+def verifiers_age():
+    return time.monotonic() - verifiers_fetched_at
+
+def have_fresh_verifiers():
+    return cached_verifiers is not None and verifiers_age() < JWKS_MAX_AGE_SECONDS
+
+async def load_verifiers(client: httpx.AsyncClient):
+    # Caller must hold jwks_lock
+    global cached_verifiers, verifiers_fetched_at, verifiers_attempted_at
+    
+    verifiers_attempted_at = time.monotonic()
+    # Swap in the new verifiers in one assignment so requests never see a partial dict
+    cached_verifiers = await fetch_verifiers(client)
+    verifiers_fetched_at = time.monotonic()
+
+async def get_verifiers(client: httpx.AsyncClient):
+    if have_fresh_verifiers():
+        return cached_verifiers
     
-    cached_keys = {key['kid']: key for key in jwks_data['keys']}
-    return cached_keys
+    async with jwks_lock:
+        # Another request may have filled the cache while we waited
+        if have_fresh_verifiers():
+            return cached_verifiers
+        
+        # Same throttle as unknown-kid refreshes, so while Auth0 is down every
+        # request doesn't start its own fetch
+        if since_last_attempt() >= JWKS_MIN_REFRESH_SECONDS:
+            try:
+                await load_verifiers(client)
+            except Exception as e:
+                print(f"JWKS fetch failed: {e}")
+        
+        if not have_fresh_verifiers():
+            raise HTTPException(status_code=503, detail="Unable to fetch signing keys")
+        return cached_verifiers
+
+def since_last_attempt():
+    return time.monotonic() - verifiers_attempted_at
+
+async def refresh_verifiers(client: httpx.AsyncClient, min_age: float = 0.0):
+    # Throttle on the last attempt, not the last success, so a failing JWKS
+    # endpoint isn't retried on every request either
+    if since_last_attempt() < min_age:
+        return
+    async with jwks_lock:
+        # Checked again under the lock so concurrent callers don't all
+        # refetch one after another
+        if since_last_attempt() < min_age:
+            return
+        try:
+            await load_verifiers(client)
+        except Exception as e:
+            # Keep serving the old verifiers; the next refresh will try again
+            print(f"JWKS refresh failed: {e}")
+
+async def refresh_verifiers_forever(client: httpx.AsyncClient):
+    # Started from main.py; keeps the cache current so requests never pay for a refresh.
+    # refresh_verifiers swallows fetch errors, so one bad JWKS response can't end the loop
+    while True:
+        await asyncio.sleep(JWKS_REFRESH_SECONDS)
+        await refresh_verifiers(client)
 
-async def validate_token(token: HTTPAuthorizationCredentials = Depends(bearer)):
+async def read_shared_payload(redis_conn, redis_key: str):
+    # Payloads verified by any gateway instance are shared through Redis;
+    # if Redis is unavailable we just fall back to verifying locally
+    try:
+        cached = await redis_conn.get(redis_key)
+    except RedisError:
+        return None
+    if cached is None:
+        return None
+    # Anything that isn't a well-formed payload is treated as a miss
+    try:
+        payload = orjson.loads(cached)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(payload, dict) or not isinstance(payload.get('exp'), (int, float)):
+        return None
+    return payload
+
+async def store_shared_payload(redis_conn, redis_key: str, payload: dict):
+    # Expire the entry when the token itself expires
+    ttl = max(1, int(payload['exp'] - time.time()))
+    try:
+        await redis_conn.set(redis_key, orjson.dumps(payload), ex=ttl)
+    except RedisError:
+        pass
+
+async def validate_token(request: Request):
     # Gets raw token string from "Bearer <token>"
-    token_string = token.credentials
+    scheme, _, token_string = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token_string:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    # Return the cached payload if this token was already verified and hasn't expired
+    token_hash = hashlib.blake2b(token_string.encode(), digest_size=16).digest()
+    cached = verified_tokens.get(token_hash)
+    if cached is not None:
+        payload, expires_at = cached
+        if expires_at > time.time():
+            return payload
+        verified_tokens.pop(token_hash, None)
+    
+    # Next, check whether another instance already verified this token
+    config = settings()
+    use_shared_cache = not config.jwt_cache_disabled
+    redis_conn = request.app.state.redis
+    # Scoped to the issuer and audience so a payload verified for a different
+    # tenant or API sharing this Redis is never accepted here
+    redis_key = f"jwt:{config.issuer}:{config.audience}:{token_hash.hex()}"
+    if use_shared_cache:
+        payload = await read_shared_payload(redis_conn, redis_key)
+        if payload is not None and payload['exp'] > time.time():
+            verified_tokens[token_hash] = (payload, payload['exp'])
+            return payload
     
     # Read token header to get key id 
     # (key id grabs the right public key to use)
-    header = jwt.get_unverified_header(token_string)
-    key_id = header.get('kid')
+    key_id = read_key_id(token_string)
     
     if not key_id:
         raise HTTPException(status_code=401, detail="Invalid token: missing key ID")
     
-    # Get public key from Auth0 JWKS using key id
-    keys = await get_public_keys()
-    matching_key = keys.get(key_id)
+    # Get the verifier for the matching Auth0 JWKS key using key id
+    client = request.app.state.http_client
+    verifiers = await get_verifiers(client)
+    verify = verifiers.get(key_id)
     
-    if not matching_key:
-        raise HTTPException(status_code=401, detail="Invalid token: key not found")
+    if verify is None:
+        # Unknown key ID may mean Auth0 just rotated keys - refresh once and
+        # look again before rejecting the token
+        await refresh_verifiers(client, min_age=JWKS_MIN_REFRESH_SECONDS)
+        verify = cached_verifiers.get(key_id)
     
-    # Build the public key
-    public_key = jwk.construct(matching_key)
+    if verify is None:
+        raise HTTPException(status_code=401, detail="Invalid token: key not found")
     
     # Verify and decode the token
     try:
-        payload = jwt.decode(
-            token_string,
-            public_key,
-            algorithms=["RS256"],
-            audience=AUTH0_AUDIENCE,
-            issuer=AUTH0_ISSUER
-        )
-        return payload
-    except JWTError:
+        payload = verify(token_string)
+    except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    
+    verified_tokens[token_hash] = (payload, payload['exp'])
+    if use_shared_cache:
+        await store_shared_payload(redis_conn, redis_key, payload)
+    return payload
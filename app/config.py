@@ -0,0 +1,33 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    auth0_domain: str
+    audience: str
+    issuer: str
+    jwks_url: str
+    redis_url: str
+    redis_max_connections: int
+    stripe_secret_key: str
+    jwt_cache_disabled: bool
+    trusted_proxies: frozenset
+
+@lru_cache
+def settings() -> Settings:
+    # Read the environment once; main.py loads .env before anything calls this
+    auth0_domain = os.getenv("AUTH0_DOMAIN")
+    return Settings(
+        auth0_domain=auth0_domain,
+        audience=os.getenv("AUTH0_AUDIENCE"),
+        issuer=f'https://{auth0_domain}/',
+        jwks_url=f'https://{auth0_domain}/.well-known/jwks.json',
+        redis_url=os.getenv("REDIS_URL", "redis://localhost:6379"),
+        redis_max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "100")),
+        stripe_secret_key=os.getenv("STRIPE_SECRET_KEY"),
+        jwt_cache_disabled=os.getenv("JWT_CACHE_DISABLED", "false").lower() in ("1", "true", "yes"),
+        trusted_proxies=frozenset(
+            ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "").split(",") if ip.strip()
+        )
+    )
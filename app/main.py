@@ -1,45 +1,88 @@
-import os
+import asyncio
+import contextlib
+import httpx
+import orjson
 import redis.asyncio as redis
-from fastapi import FastAPI, Request, Depends
-from fastapi.responses import Response
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
+from fastapi import FastAPI, Depends, Request
+from fastapi.responses import ORJSONResponse, Response
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from app.auth import validate_token
+from app.auth import validate_token, refresh_verifiers_forever
+from app.config import settings
+from app.rate_limit import RateLimitMiddleware, FIXED_WINDOW_SCRIPT, TOKEN_BUCKET_SCRIPT
 from app.telemetry import setup_telemetry, get_metrics
-from app.stripe_payments import create_payment
+from app.stripe_payments import create_payment, open_stripe_client, close_stripe_client
 
 load_dotenv()
-app = FastAPI()
-setup_telemetry(app)
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
-@app.on_event("startup")
-async def startup():
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: shared clients are created once here and live for the whole app
+    config = settings()
+    redis_url = config.redis_url
     try:
-        redis_conn = await redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
-        
-        await FastAPILimiter.init(redis_conn)
-        print(f"Connected to Redis at {REDIS_URL}")
+        # One connection pool shared by the rate limiter and the JWT cache.
+        # The blocking pool makes requests wait (up to 5s) for a free connection
+        # once all max_connections are in use, instead of failing with
+        # "Too many connections" like the plain ConnectionPool does
+        # (redis-py picks up the hiredis C parser automatically when it's installed)
+        redis_pool = redis.BlockingConnectionPool.from_url(
+            redis_url,
+            encoding="utf-8",
+            decode_responses=True,
+            max_connections=config.redis_max_connections,
+            timeout=5,
+            health_check_interval=30
+        )
+        app.state.redis = redis.Redis(connection_pool=redis_pool)
+        await app.state.redis.ping()
+        app.state.rate_limit_script = app.state.redis.register_script(FIXED_WINDOW_SCRIPT)
+        app.state.token_bucket_script = app.state.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        print(f"Connected to Redis at {redis_url}")
     except Exception as e:
         print(f"Redis connection failed: {e}")
         raise
+    
+    # One pooled client for outbound calls (JWKS) instead of a new connection each time
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=5.0,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+    )
+    open_stripe_client()
+    jwks_refresher = asyncio.create_task(refresh_verifiers_forever(app.state.http_client))
+    
+    try:
+        yield
+    finally:
+        # Shutdown: stop background work before closing the clients it uses
+        jwks_refresher.cancel()
+        await app.state.http_client.aclose()
+        await close_stripe_client()
+        await app.state.redis.aclose()
+        await redis_pool.aclose()
 
-@app.on_event("shutdown")
-async def shutdown():
-    await FastAPILimiter.close()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(RateLimitMiddleware)
+setup_telemetry(app)
+
+# Fixed responses are serialized once at import instead of on every request
+ROOT_BODY = orjson.dumps({"message": "Main Page!"})
+HEALTH_BODY = orjson.dumps({"status": "ok"})
 
 @app.get("/")
-async def get_root(rate_limiter: RateLimiter = Depends(RateLimiter(times=5, seconds=60))):
-    return {"message": "Main Page!"}
+async def get_root():
+    return Response(content=ROOT_BODY, media_type="application/json")
 
-@app.get("/health")
 async def get_health(request: Request):
-    return {"status": "ok"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
+
+# Plain Starlette route: k8s probes hit this constantly and it needs none of
+# FastAPI's dependency injection, validation or OpenAPI handling
+app.add_route("/health", get_health, methods=["GET"], include_in_schema=False)
 
 @app.get("/metrics")
-async def metrics_endpoint(request: Request):
+async def metrics_endpoint():
     """
     Prometheus metrics endpoint - exposes OpenTelemetry metrics in Prometheus format.
     
@@ -71,8 +114,7 @@ class PaymentRequest(BaseModel):
 @app.post("/api/payments/create")
 async def create_payment_endpoint(
     payment: PaymentRequest,
-    user: dict = Depends(validate_token),
-    rate_limiter: RateLimiter = Depends(RateLimiter(times=20, seconds=60))
+    user: dict = Depends(validate_token)
 ):
 
     payment_intent = await create_payment(
@@ -89,3 +131,10 @@ async def create_payment_endpoint(
         "feature": "stripe_payments"
     }
 
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # Uvicorn's defaults pick uvloop and httptools when they're installed (as in the
+    # Docker image) and fall back to asyncio on Windows, where uvloop isn't available
+    uvicorn.run(app, host="0.0.0.0", port=8000)
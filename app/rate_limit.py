@@ -0,0 +1,135 @@
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+from redis.exceptions import RedisError
+from starlette.middleware.base import BaseHTTPMiddleware
+from app.config import settings
+
+# Requests allowed per client for each rate-limited path: (times, seconds)
+PATH_LIMITS = {
+    "/": (5, 60),
+    "/api/payments/create": (20, 60),
+}
+
+# Counts a request in the current window and returns {count, seconds left}.
+# Registered once in main.py's lifespan; redis-py runs it with EVALSHA so only
+# the script hash goes over the wire on each call
+FIXED_WINDOW_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return {count, redis.call('TTL', KEYS[1])}
+"""
+
+# Token buckets for endpoints that call upstream services: (capacity, tokens per second).
+# Checked after the fixed window above, which stays as the outer limit; the bucket
+# spreads requests out so a client can't fire a whole window's worth at Stripe at once
+TOKEN_BUCKETS = {
+    "/api/payments/create": (5, 20 / 60),
+}
+
+# Refills the bucket for the time since it was last touched, then takes one token
+# if there is one. Returns {1 if allowed else 0, seconds until a token is available}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, retry_after}
+"""
+
+def too_many_requests(retry_after: int):
+    return ORJSONResponse(
+        {"detail": "Too Many Requests"},
+        status_code=429,
+        headers={"Retry-After": str(max(retry_after, 1))}
+    )
+
+def client_ip(request: Request, trusted_proxies: frozenset):
+    client_host = request.client.host if request.client else "unknown"
+    
+    # X-Forwarded-For is only believed when the request came from one of our
+    # own proxies - otherwise any client could pick its own rate-limit key
+    if client_host not in trusted_proxies:
+        return client_host
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded:
+        return client_host
+    
+    # Each proxy appends the address it received from, so the real client is the
+    # right-most hop that isn't a trusted proxy (left-most entries can be forged)
+    rest = forwarded
+    while rest:
+        rest, _, hop = rest.rpartition(",")
+        hop = hop.strip()
+        if hop and hop not in trusted_proxies:
+            return hop
+    return client_host
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """
+    Rate limiter keyed by client IP and path.
+    
+    Applies the fixed window from PATH_LIMITS and then, for upstream-bound
+    endpoints, the token bucket from TOKEN_BUCKETS. Paths in neither table
+    pass straight through without touching Redis.
+    """
+    
+    async def dispatch(self, request: Request, call_next):
+        path = request.scope["path"]
+        limit = PATH_LIMITS.get(path)
+        bucket = TOKEN_BUCKETS.get(path)
+        if limit is None and bucket is None:
+            return await call_next(request)
+        
+        client = client_ip(request, settings().trusted_proxies)
+        
+        try:
+            rejected = await self.check_limits(request, client, path, limit, bucket)
+        except RedisError as e:
+            # Fail open: a Redis outage shouldn't take the whole gateway down with it
+            print(f"Rate limit check failed, allowing request: {e}")
+            rejected = None
+        
+        if rejected is not None:
+            return rejected
+        return await call_next(request)
+    
+    async def check_limits(self, request: Request, client: str, path: str, limit, bucket):
+        # Returns a 429 response if the request is over a limit, otherwise None
+        if limit is not None:
+            times, seconds = limit
+            # One round trip: count this request, start the window if it's new,
+            # and read how long is left in it
+            count, ttl = await request.app.state.rate_limit_script(
+                keys=[f"ratelimit:{client}:{path}"], args=[seconds]
+            )
+            if count > times:
+                return too_many_requests(ttl)
+        
+        if bucket is not None:
+            capacity, rate = bucket
+            allowed, retry_after = await request.app.state.token_bucket_script(
+                keys=[f"tokenbucket:{client}:{path}"], args=[capacity, rate]
+            )
+            if not allowed:
+                return too_many_requests(retry_after)
+        
+        return None
@@ -1,20 +1,23 @@
-import os
 import stripe
 from fastapi import HTTPException
-from dotenv import load_dotenv
+from app.config import settings
 
-load_dotenv()
-stripe_secret_key = os.getenv("STRIPE_SECRET_KEY")
+def open_stripe_client():
+    # httpx-backed client so Stripe calls can be awaited instead of blocking the event loop.
+    # Created in main.py's lifespan so its connection pool is closed again on shutdown
+    stripe.default_http_client = stripe.HTTPXClient(allow_sync_methods=False)
 
-if stripe_secret_key:
-    stripe.api_key = stripe_secret_key
+async def close_stripe_client():
+    await stripe.default_http_client.close_async()
 
 async def create_payment(amount: int, currency: str = "usd", description: str = ""):
+    stripe_secret_key = settings().stripe_secret_key
     if not stripe_secret_key:
         raise HTTPException(status_code=500, detail="Stripe secret key not configured")
     
     try:
-        payment_intent = stripe.PaymentIntent.create(
+        payment_intent = await stripe.PaymentIntent.create_async(
+            api_key=stripe_secret_key,
             amount=amount,
             currency=currency, 
             description=description
@@ -115,8 +115,10 @@ WHAT DATA DO WE COLLECT?
 """
 
 import os
+import time
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.sdk.metrics import MeterProvider
@@ -132,6 +134,11 @@ from opentelemetry.sdk.resources import Resource
 
 metrics_reader = None
 
+# Last rendered /metrics payload (bytes) and when it was rendered (time.monotonic())
+# Several scrapers hitting us at once reuse this instead of re-serializing the registry
+METRICS_CACHE_SECONDS = 0.5
+cached_metrics = (0.0, None)
+
 # ============================================================================
 # TELEMETRY SETUP FUNCTION
 # ============================================================================
@@ -153,12 +160,14 @@ def setup_telemetry(app):
     """
     global metrics_reader
     
+    environment = os.getenv("ENVIRONMENT", "development")
+    
     # Create service metadata (identifies this service in telemetry data)
     # This helps when you have multiple services - you can filter by service name
     service_info = Resource.create({
         "service.name": "api-gateway",  # Name of this service
         "service.version": os.getenv("SERVICE_VERSION", "1.0.0"),  # Version for tracking
-        "deployment.environment": os.getenv("ENVIRONMENT", "development")  # dev/staging/prod
+        "deployment.environment": environment  # dev/staging/prod
     })
 
     # ========================================================================
@@ -167,17 +176,37 @@ def setup_telemetry(app):
     # Tracing tracks individual requests as they flow through the system
     # Each request gets a "trace" with multiple "spans" (steps in the request)
     
+    # Sampler - decides which requests get traced at all
+    # Tracing every request is expensive under load, so outside dev we keep ~1% of traces
+    # ParentBased means if the caller already sampled a trace, we follow its decision
+    default_ratio = "1.0" if environment == "development" else "0.01"
+    sample_ratio = float(os.getenv("TRACE_SAMPLE_RATIO", default_ratio))
+    sampler = ParentBased(TraceIdRatioBased(sample_ratio))
+    
     # Create tracer provider - this is the "recorder" for traces
-    tracer = TracerProvider(resource=service_info)
+    tracer = TracerProvider(resource=service_info, sampler=sampler)
     # Set it as the global tracer provider (OpenTelemetry uses this)
     trace.set_tracer_provider(tracer)
 
-    # Console exporter - outputs traces to console (for development/debugging)
-    # In production, you'd use an exporter that sends to a tracing backend
-    console_exporter = ConsoleSpanExporter()
+    if environment == "development":
+        # Console exporter - outputs traces to console (for development/debugging)
+        # Writing every span to stdout is too slow for real traffic, so only do it in dev
+        span_exporter = ConsoleSpanExporter()
+    else:
+        # OTLP exporter - sends traces to a tracing backend (Jaeger, Tempo, an OTel Collector...)
+        # OTLP_ENDPOINT is where that backend listens, e.g. http://otel-collector:4317
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        span_exporter = OTLPSpanExporter(endpoint=os.getenv("OTLP_ENDPOINT"))
     # Batch processor - collects spans and exports them in batches (more efficient)
-    processor = BatchSpanProcessor(console_exporter)
-    # Add processor to tracer (now traces will be exported to console)
+    # Bigger batches sent every 5s mean far fewer export calls under load
+    processor = BatchSpanProcessor(
+        span_exporter,
+        max_queue_size=8192,
+        max_export_batch_size=2048,
+        schedule_delay_millis=5000,
+        export_timeout_millis=30000
+    )
+    # Add processor to tracer (now traces will be exported)
     tracer.add_span_processor(processor)
 
     # ========================================================================
@@ -203,7 +232,11 @@ def setup_telemetry(app):
     # - Creates a trace span
     # - Records metrics (duration, status code, etc.)
     # - No manual code needed in endpoints!
-    FastAPIInstrumentor.instrument_app(app)
+    # Health probes and Prometheus scrapes are skipped - they're the most frequent
+    # requests we get and their traces tell us nothing
+    # (patterns are regexes searched against the full URL, so anchor them to the path end -
+    # otherwise a Host header like "metrics.example.com" would hide any request)
+    FastAPIInstrumentor.instrument_app(app, excluded_urls="/health$,/metrics$")
     print("OpenTelemetry initialized")
 
 # ============================================================================
@@ -214,7 +247,7 @@ def setup_telemetry(app):
 
 def get_metrics():
     """
-    Returns raw Prometheus format metrics for the /metrics endpoint.
+    Returns raw Prometheus format metrics (UTF-8 bytes) for the /metrics endpoint.
     
     Prometheus format is a text-based format that looks like:
     # HELP http_server_duration_milliseconds HTTP server request duration
@@ -222,12 +255,21 @@ def get_metrics():
     http_server_duration_milliseconds_bucket{...} 1.0
     
     Prometheus scrapes this endpoint periodically to collect metrics.
+    The rendered payload is reused for METRICS_CACHE_SECONDS so bursts of
+    scrapes don't each serialize the whole registry. It stays as bytes the
+    whole way, since the HTTP response needs bytes anyway.
     """
-    global metrics_reader
+    global metrics_reader, cached_metrics
     
     # If telemetry hasn't been initialized yet, return error message
     if metrics_reader is None:
-        return "# Metrics not ready\n"
+        return b"# Metrics not ready\n"
+    
+    # Serve the cached payload if it's still fresh
+    now = time.monotonic()
+    cached_at, cached_payload = cached_metrics
+    if cached_payload is not None and now - cached_at < METRICS_CACHE_SECONDS:
+        return cached_payload
     
     try:
         # prometheus_client is the library that formats metrics for Prometheus
@@ -235,9 +277,10 @@ def get_metrics():
         from prometheus_client import generate_latest, REGISTRY
         
         # Generate Prometheus-formatted text from all metrics in the registry
-        result = generate_latest(REGISTRY)
-        # Decode bytes to string (Prometheus expects text/plain)
-        return result.decode('utf-8')
+        # (already UTF-8 bytes - no need to decode and re-encode it for the response)
+        payload = generate_latest(REGISTRY)
+        cached_metrics = (now, payload)
+        return payload
     except Exception as e:
         # If something goes wrong, return error in Prometheus comment format
-        return f"# Error: {e}\n"
+        return f"# Error: {e}\n".encode('utf-8')